@@ -1,35 +1,35 @@
-from sqlalchemy import create_engine
-from sqlalchemy.sql import text
-from typing import Optional
+import pymysql
+from typing import List
 
 
 def execute_sql(
-    sql: str,
+    statements: List[str],
     user: str,
     password: str,
     host: str,
-    database: Optional[str] = None,
 ) -> None:
-    """Execute the provided SQL.
+    """Execute the provided SQL statements on a single connection.
 
     Args:
-        sql: A valid SQL statement to be executed.
+        statements: A list of valid SQL statements to be executed in order.
         user: A username to login to the database with.
         password: The user's password.
         host: The host IP for the database.
-        database: The name of the database.
 
     Returns:
         None.
     """
 
-    if database:
-        connection_string = f"mysql+pymysql://{user}:{password}@{host}/{database}"
-    else:
-        connection_string = f"mysql+pymysql://{user}:{password}@{host}"
     try:
-        engine = create_engine(connection_string)
-        engine.execute(text(sql))
+        connection = pymysql.connect(
+            host=host, user=user, password=password, autocommit=True
+        )
+        try:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+        finally:
+            connection.close()
     except Exception as e:
         print(f"Failed to execute the provided sql.")
         raise (e)
@@ -60,5 +60,4 @@ if __name__ == "__main__":
         "password": "password",
         "host": "localhost",
     }
-    execute_sql(sql=db_sql, **db_params)
-    execute_sql(sql=table_sql, database=db_name, **db_params)
+    execute_sql(statements=[db_sql, table_sql], **db_params)
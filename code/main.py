@@ -1,59 +1,222 @@
 import os
 import re
 import sys
+import random
+import asyncio
+import functools
+import json
+import threading
+import httpx
 import requests
 import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
-from sqlalchemy import create_engine
+from selectolax.lexbor import LexborHTMLParser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import Text, create_engine
+from sqlalchemy.engine import Engine
+from typing import Optional
+
+# Pull the numbers out of strings like '£51.77' and 'In stock (22 available)'
+PRICE_RE = re.compile(r"(\d+\.\d+)")
+AVAILABILITY_RE = re.compile(r"(\d+)")
+
+# Maps the field names of each scraped title record to the column names in the database
+COLUMN_NAMES = {
+    "Title": "title",
+    "UPC": "upc",
+    "Product Type": "product_type",
+    "Price (excl. tax)": "price_excl_tax",
+    "Price (incl. tax)": "price_incl_tax",
+    "Tax": "tax",
+    "Availability": "availability",
+    "Number of reviews": "number_of_reviews",
+    "Product Description": "product_description",
+    "Category": "category",
+}
+
+# Category pages rarely change, so remember their links between runs
+TITLE_CACHE_PATH = "title_cache.json"
+TITLE_CACHE_LOCK = threading.Lock()
+
+# Share one session across requests so connections to the host are kept alive and reused.
+# Retries happen in the transport, which backs off and honors Retry-After on 429/503.
+SESSION = requests.Session()
+SESSION.mount(
+    "http://",
+    HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1.0,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    ),
+)
+
+
+@functools.lru_cache(maxsize=4)
+def get_engine(connection_string: str) -> Engine:
+    """Create a SQLAlchemy engine, reusing it for repeat calls with the same URL.
 
+    Args:
+        connection_string: A SQLAlchemy database URL.
+
+    Returns:
+        engine: A sqlalchemy.engine.Engine with its own connection pool.
+    """
+
+    return create_engine(
+        connection_string, pool_pre_ping=True, pool_size=5, max_overflow=5
+    )
+
+
+def backoff_delay(response: Optional[httpx.Response], attempt: int) -> float:
+    """Compute how long to wait before retrying a request.
+
+    Args:
+        response: The httpx.Response from the failed attempt, or None if no response
+                  was received.
+        attempt: The number of the attempt that failed, starting at 1.
+
+    Returns:
+        delay: The number of seconds to wait. Uses the server's Retry-After header
+               (capped at 60 seconds) if present, otherwise exponential backoff with
+               full jitter.
+    """
+
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), 60.0)
+        except ValueError:
+            # Retry-After may also be an HTTP date. Fall back to our own backoff.
+            pass
+
+    return min(30, 1.0 * (2**attempt)) * random.random()
 
-def get_response(url: str) -> list:
+
+def get_response(url: str, headers: Optional[dict] = None) -> list:
     """Collect the HTTP response from the URL.
 
     Args:
         url: URL for an API endpoint.
+        headers: Extra HTTP headers to send, e.g. for a conditional GET.
 
     Returns:
         response: A requests.Response object containing the HTTP response.
         status_code: An int with the HTTP status code.
     """
 
+    # Retries and backoff are handled by the session's HTTPAdapter. If they are exhausted
+    # on a bad status code, the last response is returned as is.
+    try:
+        response = SESSION.get(url, headers=headers, timeout=(5, 30))
+    except requests.RequestException as e:
+        print(f"No response from {url}: {e}")
+        return [None, None]
+
+    return [response, response.status_code]
+
+
+async def get_response_async(client: httpx.AsyncClient, url: str) -> list:
+    """Collect the HTTP response from the URL without blocking the event loop.
+
+    Args:
+        client: An httpx.AsyncClient whose connection pool is shared between requests.
+        url: URL for an API endpoint.
+
+    Returns:
+        response: An httpx.Response object containing the HTTP response.
+        status_code: An int with the HTTP status code.
+    """
+
     n_attempts = 5
 
     # Make {n_attempts} to get a response. Return [response, status_code] if successful.
     for attempt in range(1, n_attempts + 1):
 
         try:
-            response = requests.get(url)
+            response = await client.get(url)
 
             # 200 response is OK. Return it.
             if response.status_code == 200:
                 return [response, response.status_code]
 
-            # 429 response means we are sending too many requests. Wait 60 seconds before trying again.
+            # 429 response means we are sending too many requests. Back off before trying again.
+            # If retries are exhausted, return what we have.
             elif response.status_code == 429:
-                print(
-                    f"Too many requests on attempt number {attempt}. Backing off for 60 seconds..."
-                )
-                time.sleep(60)
-                continue
+                if attempt < n_attempts:
+                    delay = backoff_delay(response, attempt)
+                    print(
+                        f"Too many requests on attempt number {attempt}. Backing off for {delay:.1f} seconds..."
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                elif attempt == n_attempts:
+                    return [response, response.status_code]
 
-            # If we did not get a 200 response, retry. If retries are exhausted, return what we have.
+            # If we did not get a 200 response, back off and retry. If retries are exhausted, return what we have.
             else:
                 if attempt < n_attempts:
+                    await asyncio.sleep(backoff_delay(response, attempt))
                     continue
                 elif attempt == n_attempts:
                     return [response, response.status_code]
 
-        except requests.ConnectTimeout:
+        # Any transport failure (timeouts, dropped connections, protocol errors) is retried.
+        except httpx.TransportError:
             print(f"No response from {url} on attempt number {attempt}. Retrying...")
+            if attempt < n_attempts:
+                await asyncio.sleep(backoff_delay(None, attempt))
             continue
 
     # Return [None, None] if all attempts fail.
     return [None, None]
 
 
+def load_title_cache() -> dict:
+    """Read the cached category links from disk.
+
+    Returns:
+        cache: A dict mapping category URLs to their etag, last_modified and links.
+    """
+
+    if not os.path.exists(TITLE_CACHE_PATH):
+        return {}
+
+    try:
+        with open(TITLE_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print("Could not read the title cache. Ignoring it.")
+        return {}
+
+
+def update_title_cache(url: str, entry: dict) -> None:
+    """Write the cached links for one category to disk.
+
+    Args:
+        url: URL for a particular category.
+        entry: A dict containing the category's etag, last_modified and links.
+
+    Returns:
+        None.
+    """
+
+    # Categories may be fetched from several threads, so read-modify-write under a lock
+    with TITLE_CACHE_LOCK:
+        cache = load_title_cache()
+        cache[url] = entry
+        with open(TITLE_CACHE_PATH, "w") as f:
+            json.dump(cache, f)
+
+
 def fetch_titles(url: str) -> list:
     """Collect the links to all titles in a category.
 
@@ -67,20 +230,39 @@ def fetch_titles(url: str) -> list:
                http://books.toscrape.com/catalogue/<book_title>_<book_id>/index.html
     """
 
-    response, status_code = get_response(url)
+    with TITLE_CACHE_LOCK:
+        cached = load_title_cache().get(url)
 
-    if status_code == 200:
-        html_doc = response.text
-        soup = BeautifulSoup(html_doc, "html.parser")
+    # Ask the server to skip the body if the page has not changed since we cached it
+    headers = {}
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    response, status_code = get_response(url, headers=headers)
+
+    if status_code == 304 and cached:
+        links = cached["links"]
+
+    elif status_code == 200:
+        html_doc = response.content
+        tree = LexborHTMLParser(html_doc)
 
         # The only tags with a title are the tags for book titles
-        tags = soup.find_all(title=True)
-        hrefs = [tag["href"] for tag in tags]
+        nodes = tree.css("a[title]")
+        hrefs = [node.attributes["href"] for node in nodes]
 
         # The original path looks like '../../../<book_title>/index.html'
-        base_url = "http://books.toscrape.com/catalogue"
-        pages = [str(href.rsplit("../")[-1]) for href in hrefs]
-        links = [os.path.join(base_url, page) for page in pages]
+        prefix = "http://books.toscrape.com/catalogue/"
+        links = [prefix + href.rpartition("../")[2] for href in hrefs]
+
+        entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "links": links,
+        }
+        update_title_cache(url, entry)
 
     else:
         print("Bad status code. Cannot fetch links.")
@@ -89,15 +271,17 @@ def fetch_titles(url: str) -> list:
     return links
 
 
-def fetch_title_info(url: str) -> pd.DataFrame:
+async def fetch_title_info(client: httpx.AsyncClient, url: str) -> Optional[dict]:
     """Collect the data for a particular title.
 
     Args:
+        client: An httpx.AsyncClient used to send the request.
         url: URL for a particular book title. Should look like:
              http://books.toscrape.com/catalogue/<book_title>_<book_id>/index.html
 
     Returns:
-        df: A dataframe containing the following fields:
+        data: A dict containing the following fields, or None if the page could
+              not be fetched:
               Title: str
               UPC: str
               Product Type: str
@@ -109,15 +293,21 @@ def fetch_title_info(url: str) -> pd.DataFrame:
               Product Description: str
     """
 
-    response, status_code = get_response(url)
+    response, status_code = await get_response_async(client, url)
 
     if status_code == 200:
-        html_doc = response.text
-        soup = BeautifulSoup(html_doc, "html.parser")
-
-        product_description_tag = soup.find_all(id="product_description")[0]
-        product_description = product_description_tag.next_sibling.next_sibling.text
-        product_info = [tag.text for tag in soup.find_all("td")]
+        html_doc = response.content
+        tree = LexborHTMLParser(html_doc)
+
+        # Collect the product info cells and the description (the <p> directly following
+        # the "Product Description" header) in a single walk of the document
+        product_description = None
+        product_info = []
+        for node in tree.css("#product_description + p, table.table td"):
+            if node.tag == "td":
+                product_info.append(node.text())
+            else:
+                product_description = node.text()
 
         fields = [
             "UPC",
@@ -128,32 +318,47 @@ def fetch_title_info(url: str) -> pd.DataFrame:
             "Availability",
             "Number of reviews",
         ]
-        data = dict(zip(fields, product_info))
-        data["Product Description"] = product_description
 
         # The original url looks like 'http://books.toscrape.com/catalogue/<book_title>_<book_id>/index.html'
-        data["Title"] = url.split("/")[-2].split("_")[0]
-
-        columns = ["Title"] + fields + ["Product Description"]
-        df = pd.DataFrame(data, index=[0], columns=columns)
+        data = {"Title": url.split("/")[-2].split("_")[0]}
+        data.update(zip(fields, product_info))
+        data["Product Description"] = product_description
 
     else:
         print("Bad status code. Cannot fetch data.")
-        df = pd.DataFrame(
-            columns=[
-                "Title",
-                "UPC",
-                "Product Type",
-                "Price (excl. tax)",
-                "Price (incl. tax)",
-                "Tax",
-                "Availability",
-                "Number of reviews",
-                "Product Description",
-            ]
-        )
+        data = None
 
-    return df
+    return data
+
+
+async def gather_title_info(category_links: dict) -> list:
+    """Collect the data for every title in every category concurrently.
+
+    Args:
+        category_links: A dict mapping a category name to the links for its titles,
+                        as returned by fetch_titles.
+
+    Returns:
+        records: A list of dicts, one per title that was fetched successfully. Each
+                 dict has the fields returned by fetch_title_info plus its Category.
+    """
+
+    categories = [
+        category for category, links in category_links.items() for _ in links
+    ]
+    links = [link for links in category_links.values() for link in links]
+
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        data = await asyncio.gather(*[fetch_title_info(client, link) for link in links])
+
+    records = []
+    for category, record in zip(categories, data):
+        if record is not None:
+            record["Category"] = category
+            records.append(record)
+
+    return records
 
 
 def clean_data(df: pd.DataFrame) -> pd.DataFrame:
@@ -170,6 +375,7 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
               Availability: str
               Number of reviews: str
               Product Description: str
+              Category: str
     Returns:
         df: A dataframe containing the following fields:
               title: str
@@ -181,34 +387,29 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
               availability: int
               number_of_reviews: int
               product_description: str
+              category: str
     """
 
-    def convert_price(price: str) -> float:
-        return list(re.findall(r"\d+\.\d+", price))[0]
-
-    def convert_availability(availability: str) -> int:
-        return list(re.findall(r"\d+", availability))[0]
-
-    df["Availability"] = df["Availability"].apply(convert_availability)
-    df["Price (excl. tax)"] = df["Price (excl. tax)"].apply(convert_price)
-    df["Price (incl. tax)"] = df["Price (incl. tax)"].apply(convert_price)
-    df["Tax"] = df["Tax"].apply(convert_price)
+    df["Availability"] = df["Availability"].str.extract(AVAILABILITY_RE, expand=False)
+    df["Price (excl. tax)"] = df["Price (excl. tax)"].str.extract(
+        PRICE_RE, expand=False
+    )
+    df["Price (incl. tax)"] = df["Price (incl. tax)"].str.extract(
+        PRICE_RE, expand=False
+    )
+    df["Tax"] = df["Tax"].str.extract(PRICE_RE, expand=False)
 
     schema = {
-        "title": np.dtype("object"),
-        "upc": np.dtype("object"),
-        "product_type": np.dtype("object"),
         "price_excl_tax": np.dtype("float64"),
         "price_incl_tax": np.dtype("float64"),
         "tax": np.dtype("float64"),
         "availability": np.dtype("int64"),
         "number_of_reviews": np.dtype("int64"),
-        "product_description": np.dtype("object"),
     }
-    columns = list(schema.keys())
 
-    df.columns = columns
-    df = df.astype(schema).reset_index(drop=True)
+    # Leave the text columns as they are and only cast the numeric columns
+    df.rename(columns=COLUMN_NAMES, inplace=True)
+    df = df.astype(schema)
 
     return df
 
@@ -245,8 +446,17 @@ def load_data(
     else:
         try:
             connection_string = f"mysql+pymysql://{user}:{password}@{host}/{database}"
-            engine = create_engine(connection_string)
-            df.to_sql(name=table, con=engine, if_exists="append", index=False)
+            engine = get_engine(connection_string)
+            with engine.begin() as connection:
+                df.to_sql(
+                    name=table,
+                    con=connection,
+                    if_exists="append",
+                    index=False,
+                    method="multi",
+                    chunksize=500,
+                    dtype={"product_description": Text},
+                )
 
         except Exception as e:
             print("Failed to Load Data.")
@@ -263,24 +473,22 @@ if __name__ == "__main__":
         "database": "book_db",
         "table": "BooksToScrape",
     }
-    base_url = "http://books.toscrape.com/catalogue"
-    science_url = os.path.join(base_url, "category/books/science_22")
-    poetry_url = os.path.join(base_url, "category/books/poetry_23")
-
-    science_links = fetch_titles(science_url)
-    poetry_links = fetch_titles(poetry_url)
-
-    science_data = [fetch_title_info(link) for link in science_links]
-    poetry_data = [fetch_title_info(link) for link in poetry_links]
+    base_url = "http://books.toscrape.com/catalogue/"
+    category_urls = {
+        "Science": base_url + "category/books/science_22",
+        "Poetry": base_url + "category/books/poetry_23",
+    }
 
-    science_df = pd.concat(science_data)
-    poetry_df = pd.concat(poetry_data)
+    # Fetch the category pages in parallel. The shared session is safe to use across threads.
+    with ThreadPoolExecutor(max_workers=len(category_urls)) as executor:
+        category_links = dict(
+            zip(category_urls, executor.map(fetch_titles, category_urls.values()))
+        )
 
-    clean_science_df = clean_data(science_df)
-    clean_poetry_df = clean_data(poetry_df)
+    # Build one dataframe for all categories so they are cleaned and loaded in one pass
+    records = asyncio.run(gather_title_info(category_links))
+    df = pd.DataFrame.from_records(records, columns=list(COLUMN_NAMES))
 
-    clean_science_df["category"] = "Science"
-    clean_poetry_df["category"] = "Poetry"
+    clean_df = clean_data(df)
 
-    load_data(df=clean_science_df, **db_params)
-    load_data(df=clean_poetry_df, **db_params)
+    load_data(df=clean_df, **db_params)